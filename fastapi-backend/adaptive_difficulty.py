@@ -8,19 +8,19 @@ user ability levels and determine appropriate difficulty levels for questions.
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
+import bisect
+import itertools
+import logging
+import math
 import numpy as np
-from datetime import datetime, timedelta
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from numba import njit
+from datetime import datetime, timedelta, timezone
+from fastapi.concurrency import run_in_threadpool
+from deps import supabase, service_supabase
+from postgrest.types import ReturnMethod
+from cachetools import TTLCache
 
-# Load environment variables
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = logging.getLogger(__name__)
 
 # Create router
 router = APIRouter()
@@ -29,6 +29,24 @@ router = APIRouter()
 INITIAL_ABILITY = 0.0  # Standard IRT scale (approximately -3 to +3)
 INITIAL_GUESS = 0.25   # Probability of guessing correctly (for 4 choices)
 INITIAL_SLIP = 0.1     # Probability of slipping on a known answer
+MIN_RESPONSES_FOR_NEWTON = 3  # Below this, use the success-rate estimate directly
+
+# Computed user abilities, keyed by user_id. Entries expire after a minute and
+# are dropped as soon as the user records a new answer.
+ABILITY_CACHE_TTL = 60
+_ability_cache = TTLCache(maxsize=10_000, ttl=ABILITY_CACHE_TTL)
+
+# Invalidation stamps the user with a fresh value from this counter. A compute
+# only writes the cache if the stamp is unchanged since it started, so an estimate
+# read before an answer was recorded isn't cached after that answer.
+_ability_generation_counter = itertools.count(1)
+_ability_generation = TTLCache(maxsize=10_000, ttl=ABILITY_CACHE_TTL)
+
+# user_progress inserts (batched, single-row and asyncpg) can commit out of id
+# order, so a row may become visible after a higher id. Only rows recorded longer
+# ago than this are folded into the persisted counts and watermark; newer rows
+# still count towards the current estimate and are fetched again next time.
+PROGRESS_COMMIT_LAG = timedelta(seconds=60)
 
 # Models
 class TopicAbility(BaseModel):
@@ -70,11 +88,100 @@ def calculate_success_probability(ability, difficulty, discrimination=1.0, guess
     Returns:
     - Probability of a correct response
     """
-    # 3-parameter logistic model
-    z = discrimination * (ability - difficulty)
-    p = guess + (1 - guess) / (1 + np.exp(-z))
+    # 3-parameter logistic model; math.exp avoids NumPy's dispatch cost on scalars
+    # Clamp z to prevent exp overflow
+    z = min(max(discrimination * (ability - difficulty), -15.0), 15.0)
+    p = guess + (1 - guess) / (1 + math.exp(-z))
     return p
 
+# Explicit signatures make Numba compile the kernels eagerly at import (or load
+# them from the on-disk cache) rather than on the first call from a live request
+_ABILITY_KERNEL_SIG = "UniTuple(float64, 2)(float64[:], float64[:], float64[:], float64, float64, float64, float64, int64, float64)"
+_DIFFICULTY_KERNEL_SIG = "UniTuple(float64, 2)(float64[:], float64[:], float64[:], float64, float64, float64, int64, float64)"
+
+@njit(_ABILITY_KERNEL_SIG, cache=True, fastmath=True)
+def _estimate_ability_kernel(responses, difficulties, discriminations, guess, prior_ability,
+                             prior_weight, start_ability, max_iter, tolerance):
+    """
+    Newton-Raphson kernel for estimate_ability, compiled to native code.
+    
+    Gradient and Hessian are accumulated in a single pass over the responses.
+    Returns the ability estimate and the final Hessian.
+    """
+    ability = start_ability
+    hessian = -prior_weight
+    # Loop invariant of the 3PL formula, hoisted out of the per-response pass
+    slope = 1 - guess
+    
+    for _ in range(max_iter):
+        gradient = prior_weight * (prior_ability - ability)
+        hessian = -prior_weight
+        
+        for i in range(responses.shape[0]):
+            disc = discriminations[i]
+            # Clamp z to prevent exp overflow
+            z = min(max(disc * (ability - difficulties[i]), -15.0), 15.0)
+            p = guess + slope / (1 + math.exp(-z))
+            # Ensure p is in valid range to prevent division by zero
+            p = min(max(p, 0.001), 0.999)
+            gradient += (responses[i] - p) * disc
+            hessian -= p * (1 - p) * disc * disc
+        
+        # Ensure hessian is not too close to zero
+        if abs(hessian) < 0.01:
+            hessian = -0.01
+        
+        # Newton-Raphson update, limiting step size to prevent big jumps
+        update = min(max(gradient / hessian, -0.5), 0.5)
+        
+        # Keep ability in reasonable bounds
+        ability_new = min(max(ability + update, -3.0), 3.0)
+        
+        # Check for convergence
+        if abs(ability_new - ability) < tolerance:
+            ability = ability_new
+            break
+        
+        ability = ability_new
+    
+    return ability, hessian
+
+@njit(_DIFFICULTY_KERNEL_SIG, cache=True, fastmath=True)
+def _estimate_difficulty_kernel(responses, abilities, discriminations, guess, prior_difficulty,
+                                prior_weight, max_iter, tolerance):
+    """
+    Newton-Raphson kernel for estimate_question_difficulty, compiled to native code.
+    
+    Like the ability kernel, gradient and Hessian are accumulated in a single pass.
+    Returns the difficulty estimate and the final Hessian.
+    """
+    difficulty = prior_difficulty
+    hessian = -prior_weight
+    slope = 1 - guess
+    
+    for _ in range(max_iter):
+        # For difficulty, gradient is negative of ability gradient
+        gradient = prior_weight * (prior_difficulty - difficulty)
+        hessian = -prior_weight
+        
+        for i in range(responses.shape[0]):
+            disc = discriminations[i]
+            z = min(max(disc * (abilities[i] - difficulty), -15.0), 15.0)
+            p = guess + slope / (1 + math.exp(-z))
+            p = min(max(p, 0.001), 0.999)
+            gradient -= (responses[i] - p) * disc
+            hessian -= p * (1 - p) * disc * disc
+        
+        difficulty_new = difficulty + gradient / (hessian - 1e-8)
+        
+        if abs(difficulty_new - difficulty) < tolerance:
+            difficulty = difficulty_new
+            break
+        
+        difficulty = difficulty_new
+    
+    return difficulty, hessian
+
 def estimate_ability(responses, difficulties, discriminations=None, guess=0.25, prior_ability=0.0, 
                     prior_weight=1.0, max_iter=25, tolerance=0.001):
     """
@@ -94,84 +201,45 @@ def estimate_ability(responses, difficulties, discriminations=None, guess=0.25,
     - Estimated ability
     - Confidence metric (inverse of posterior variance)
     """
-    if not responses:
+    if len(responses) == 0:
         return prior_ability, 0.0
     
     if discriminations is None:
         discriminations = [1.0] * len(difficulties)
     
-    # Initialize with prior
-    ability = prior_ability
+    rs = np.asarray(responses, dtype=np.float64)
+    diffs = np.asarray(difficulties, dtype=np.float64)
+    discs = np.asarray(discriminations, dtype=np.float64)
     
     # Simple estimate based on success rate as a starting point
-    success_rate = sum(responses) / len(responses)
+    success_rate = float(rs.mean())
     # Map success rate to IRT scale (roughly -3 to +3)
     # 0% -> -3, 50% -> 0, 100% -> +3
     simple_ability = (success_rate - 0.5) * 6
-    ability = min(max(simple_ability, -3.0), 3.0)  # Clamp to reasonable range
+    start_ability = min(max(simple_ability, -3.0), 3.0)  # Clamp to reasonable range
     
-    # Add a safety check to prevent numerical instability
-    safe_iterations = 0
+    # With too few responses, or all correct/all wrong, the likelihood has no
+    # interior maximum and Newton-Raphson just runs into the clamp, so skip it
+    if len(rs) < MIN_RESPONSES_FOR_NEWTON or success_rate in (0.0, 1.0):
+        return start_ability, 0.5 * len(rs)
     
     # Use Newton-Raphson to find maximum of likelihood
-    for _ in range(max_iter):
-        safe_iterations += 1
-        if safe_iterations > 10:  # Limit iterations for safety
-            break
-            
-        try:
-            # Compute probabilities with current estimate
-            probs = []
-            for diff, disc in zip(difficulties, discriminations):
-                # Calculate success probability with safety checks
-                z = disc * (ability - diff)
-                # Clamp z to prevent exp overflow
-                z = min(max(z, -15.0), 15.0)
-                p = guess + (1 - guess) / (1 + np.exp(-z))
-                # Ensure p is in valid range to prevent division by zero
-                p = min(max(p, 0.001), 0.999)
-                probs.append(p)
-            
-            # Compute first derivative (gradient)
-            gradient = sum([(r - p) * disc for r, p, disc in zip(responses, probs, discriminations)])
-            gradient += prior_weight * (prior_ability - ability)  # Add prior gradient
-            
-            # Compute second derivative (Hessian)
-            hessian = -sum([p * (1 - p) * disc**2 for p, disc in zip(probs, discriminations)])
-            hessian -= prior_weight  # Add prior hessian
-            
-            # Ensure hessian is not too close to zero
-            if abs(hessian) < 0.01:
-                hessian = -0.01 if hessian < 0 else -0.01
-            
-            # Newton-Raphson update with step size limitation
-            update = gradient / hessian
-            # Limit step size to prevent big jumps
-            update = min(max(update, -0.5), 0.5)
-            
-            ability_new = ability + update
-            
-            # Keep ability in reasonable bounds
-            ability_new = min(max(ability_new, -3.0), 3.0)
-            
-            # Check for convergence
-            if abs(ability_new - ability) < tolerance:
-                ability = ability_new
-                break
-            
-            ability = ability_new
-            
-        except Exception as e:
-            print(f"Error in ability estimation: {e}")
-            # Fallback to simple estimate based on success rate
-            return simple_ability, 0.5
+    try:
+        ability, hessian = _estimate_ability_kernel(
+            rs, diffs, discs, float(guess), float(prior_ability), float(prior_weight),
+            float(start_ability), int(max_iter), float(tolerance)
+        )
+    except Exception as e:
+        logger.warning("Error in ability estimation: %s", e)
+        # Fallback to simple estimate based on success rate
+        return simple_ability, 0.5
     
     # Confidence is inverse of posterior variance
     confidence = min(abs(hessian), 10.0)  # Cap confidence
     
     # Final sanity check
     if not (-3.0 <= ability <= 3.0):
-        print(f"WARNING: Ability estimate outside normal range: {ability}")
+        logger.warning("Ability estimate outside normal range: %s", ability)
         ability = min(max(ability, -3.0), 3.0)
     
     return ability, confidence
@@ -195,42 +263,41 @@ def estimate_question_difficulty(responses, abilities, discriminations=None, gue
     - Estimated difficulty
     - Confidence metric
     """
-    if not responses or not abilities:
+    if len(responses) == 0 or len(abilities) == 0:
         return prior_difficulty, 0.0
     
     if discriminations is None:
         discriminations = [1.0] * len(abilities)
     
-    # Initialize with prior
-    difficulty = prior_difficulty
+    rs = np.asarray(responses, dtype=np.float64)
     
-    # Use Newton-Raphson
-    for _ in range(max_iter):
-        # Compute probabilities with current estimate
-        probs = [calculate_success_probability(ab, difficulty, disc, guess) 
-                for ab, disc in zip(abilities, discriminations)]
-        
-        # For difficulty, gradient is negative of ability gradient
-        gradient = -sum([(r - p) * disc for r, p, disc in zip(responses, probs, discriminations)])
-        gradient += prior_weight * (prior_difficulty - difficulty)
-        
-        hessian = -sum([p * (1 - p) * disc**2 for p, disc in zip(probs, discriminations)])
-        hessian -= prior_weight
-        
-        update = gradient / (hessian - 1e-8)
-        
-        difficulty_new = difficulty + update
-        
-        if abs(difficulty_new - difficulty) < tolerance:
-            difficulty = difficulty_new
-            break
-        
-        difficulty = difficulty_new
+    # Same short-circuit as estimate_ability, mirrored: 0% -> +3, 100% -> -3
+    success_rate = float(rs.mean())
+    if len(rs) < MIN_RESPONSES_FOR_NEWTON or success_rate in (0.0, 1.0):
+        return (0.5 - success_rate) * 6, 0.5 * len(rs)
+    
+    difficulty, hessian = _estimate_difficulty_kernel(
+        rs,
+        np.asarray(abilities, dtype=np.float64),
+        np.asarray(discriminations, dtype=np.float64),
+        float(guess), float(prior_difficulty), float(prior_weight), int(max_iter), float(tolerance)
+    )
     
     confidence = abs(hessian)
     
     return difficulty, confidence
 
+@router.on_event("startup")
+def warm_irt_kernels():
+    """Run each kernel once so dispatch and page-in costs are paid before the first request."""
+    warmup = np.zeros(1)
+    _estimate_ability_kernel(warmup, warmup, warmup, INITIAL_GUESS, INITIAL_ABILITY, 1.0, 0.0, 1, 0.001)
+    _estimate_difficulty_kernel(warmup, warmup, warmup, INITIAL_GUESS, 0.0, 1.0, 1, 0.001)
+
+# Upper bounds (inclusive) of difficulty levels 1-4 on the IRT scale
+_LEVEL_BOUNDS = (-1.5, -0.5, 0.5, 1.5)
+_LEVEL_BINS = np.array(_LEVEL_BOUNDS)
+
 def irt_to_difficulty_level(irt_difficulty):
     """
     Convert IRT difficulty parameter to a 1-5 scale.
@@ -239,104 +306,278 @@ def irt_to_difficulty_level(irt_difficulty):
     -1.5 to -0.5: Easy (2)
     -0.5 to 0.5: Medium (3)
     0.5 to 1.5: Hard (4)
-    ≥ 1.5: Very Hard (5)
-    """
-    if irt_difficulty <= -1.5:
-        return 1
-    elif irt_difficulty <= -0.5:
-        return 2
-    elif irt_difficulty <= 0.5:
-        return 3
-    elif irt_difficulty <= 1.5:
-        return 4
-    else:
-        return 5
+    > 1.5: Very Hard (5)
+    """
+    # bisect on a tuple avoids NumPy's dispatch cost for a single scalar
+    return bisect.bisect_left(_LEVEL_BOUNDS, irt_difficulty) + 1
+
+def irt_to_difficulty_levels(irt_difficulties):
+    """Vectorized irt_to_difficulty_level for an array of IRT difficulty parameters."""
+    return np.searchsorted(_LEVEL_BINS, irt_difficulties, side="left") + 1
+
+# IRT difficulty parameter for each 1-5 difficulty level (index 0 is unused)
+_LEVEL_TO_IRT = (
+    0.0,
+    -2.0,  # Very Easy
+    -1.0,  # Easy
+    0.0,   # Medium
+    1.0,   # Hard
+    2.0    # Very Hard
+)
+_DIFFICULTY_LEVELS = (1, 2, 3, 4, 5)
+_LEVEL_TO_IRT_ARR = np.array(_LEVEL_TO_IRT)
 
 def difficulty_level_to_irt(level):
     """Convert a 1-5 difficulty level to an IRT difficulty parameter."""
-    mapping = {
-        1: -2.0,  # Very Easy
-        2: -1.0,  # Easy
-        3: 0.0,   # Medium
-        4: 1.0,   # Hard
-        5: 2.0    # Very Hard
-    }
-    return mapping.get(level, 0.0)
+    if level in _DIFFICULTY_LEVELS:
+        return _LEVEL_TO_IRT[int(level)]
+    return 0.0
 
-# Endpoints
-@router.get("/user-ability/{user_id}")
-async def get_user_ability(user_id: str):
+def _progress_arrays(answers):
     """
-    Retrieve the ability level of a user, overall and by topic.
+    Convert user_progress rows into (topics, responses, level indices) arrays.
+    
+    Level indices point into _LEVEL_TO_IRT_ARR; missing or out-of-range levels
+    use index 0 (0.0), like difficulty_level_to_irt.
     """
-    try:
-        # Load the user's history of responses
-        response = supabase.table("user_progress").select("*").eq("user_id", user_id).execute()
-        
-        if not response.data:
-            return {
-                "user_id": user_id,
-                "overall_ability": INITIAL_ABILITY,
-                "topic_abilities": {},
-                "questions_answered": 0
-            }
-        
-        # Process the data
-        questions_by_topic = {}
-        overall_responses = []
-        overall_difficulties = []
+    count = len(answers)
+    topics = np.array([answer.get("topic") or "Unknown" for answer in answers])
+    responses = np.fromiter(
+        (1.0 if answer.get("correct", False) else 0.0 for answer in answers),
+        dtype=np.float64, count=count
+    )
+    levels = np.fromiter(
+        (answer.get("difficulty_level") or 0 for answer in answers),
+        dtype=np.int64, count=count
+    )
+    levels[(levels < 1) | (levels > 5)] = 0
+    return topics, responses, levels
+
+def _add_level_counts(answers, level_counts=None):
+    """
+    Add user_progress rows to per-topic answered/correct counts by difficulty level.
+    
+    The estimators only depend on how many answers (and correct answers) a user
+    has at each difficulty level, so these counts summarise the whole progress
+    history and can be brought up to date from new rows alone.
+    """
+    level_counts = dict(level_counts or {})
+    topics, responses, levels = _progress_arrays(answers)
+    
+    topic_names, topic_index = np.unique(topics, return_inverse=True)
+    for k, topic in enumerate(topic_names.tolist()):
+        in_topic = topic_index == k
+        answered = np.bincount(levels[in_topic], minlength=len(_LEVEL_TO_IRT))
+        correct = np.bincount(levels[in_topic], weights=responses[in_topic], minlength=len(_LEVEL_TO_IRT))
         
-        for answer in response.data:
-            topic = answer.get("topic", "Unknown")
-            correct = answer.get("correct", False)
-            difficulty_level = answer.get("difficulty_level", 3)
-            
-            # Convert reported difficulty level to IRT scale
-            difficulty = difficulty_level_to_irt(difficulty_level)
-            
-            # Add to topic-specific data
-            if topic not in questions_by_topic:
-                questions_by_topic[topic] = {"responses": [], "difficulties": []}
-            
-            questions_by_topic[topic]["responses"].append(1 if correct else 0)
-            questions_by_topic[topic]["difficulties"].append(difficulty)
-            
-            # Add to overall data
-            overall_responses.append(1 if correct else 0)
-            overall_difficulties.append(difficulty)
+        previous = level_counts.get(topic, {"answered": [0] * len(_LEVEL_TO_IRT), "correct": [0] * len(_LEVEL_TO_IRT)})
+        level_counts[topic] = {
+            "answered": (np.asarray(previous["answered"]) + answered).tolist(),
+            "correct": (np.asarray(previous["correct"]) + correct.astype(np.int64)).tolist()
+        }
+    
+    return level_counts
+
+def _settled_answers(answers, cutoff: datetime):
+    """
+    Return the leading answers (sorted by id) recorded at or before cutoff, stopping
+    at the first newer one, so every id up to the last returned row has committed.
+    """
+    for i, answer in enumerate(answers):
+        recorded = answer.get("timestamp")
+        if recorded is None:
+            continue
+        recorded = datetime.fromisoformat(recorded)
+        if recorded.tzinfo is not None:
+            recorded = recorded.astimezone(timezone.utc).replace(tzinfo=None)
+        if recorded > cutoff:
+            return answers[:i]
+    return answers
+
+def _counts_to_arrays(answered, correct):
+    """Expand per-level answered/correct counts into solver response and difficulty arrays."""
+    answered = np.asarray(answered, dtype=np.int64)
+    correct = np.asarray(correct, dtype=np.int64)
+    responses = np.concatenate((np.ones(correct.sum()), np.zeros(answered.sum() - correct.sum())))
+    difficulties = np.concatenate((
+        np.repeat(_LEVEL_TO_IRT_ARR, correct),
+        np.repeat(_LEVEL_TO_IRT_ARR, answered - correct)
+    ))
+    return responses, difficulties
+
+def _abilities_from_counts(user_id: str, level_counts):
+    """
+    Estimate a user's overall and per-topic ability from their level counts.
+    """
+    overall_answered = np.sum([entry["answered"] for entry in level_counts.values()], axis=0)
+    overall_correct = np.sum([entry["correct"] for entry in level_counts.values()], axis=0)
+    responses, difficulties = _counts_to_arrays(overall_answered, overall_correct)
+    
+    # Calculate overall ability
+    overall_ability, overall_confidence = estimate_ability(
+        responses, difficulties, prior_ability=INITIAL_ABILITY
+    )
+    
+    # Calculate topic-specific abilities
+    topic_abilities = {}
+    for topic, entry in level_counts.items():
+        topic_responses, topic_difficulties = _counts_to_arrays(entry["answered"], entry["correct"])
         
-        # Calculate overall ability
-        overall_ability, overall_confidence = estimate_ability(
-            overall_responses, overall_difficulties, prior_ability=INITIAL_ABILITY
+        ability, confidence = estimate_ability(
+            topic_responses, topic_difficulties, prior_ability=overall_ability
         )
         
-        # Calculate topic-specific abilities
-        topic_abilities = {}
-        for topic, data in questions_by_topic.items():
-            ability, confidence = estimate_ability(
-                data["responses"], data["difficulties"], prior_ability=overall_ability
-            )
-            
-            topic_abilities[topic] = {
-                "topic": topic,
-                "ability": ability,
-                "confidence": confidence,
-                "question_count": len(data["responses"]),
-                "average_difficulty": sum(data["difficulties"]) / len(data["difficulties"]) if data["difficulties"] else 0,
-                "success_rate": sum(data["responses"]) / len(data["responses"]) if data["responses"] else 0
-            }
-        print(f"DEBUG - User: {user_id}, Overall ability: {overall_ability}, Topic abilities: {topic_abilities}")
+        topic_abilities[topic] = {
+            "topic": topic,
+            "ability": ability,
+            "confidence": confidence,
+            "question_count": len(topic_responses),
+            "average_difficulty": float(topic_difficulties.mean()),
+            "success_rate": float(topic_responses.mean())
+        }
+    logger.debug("User: %s, Overall ability: %s, Topic abilities: %s", user_id, overall_ability, topic_abilities)
+    
+    return {
+        "user_id": user_id,
+        "overall_ability": overall_ability,
+        "overall_confidence": overall_confidence,
+        "topic_abilities": topic_abilities,
+        "questions_answered": len(responses)
+    }
 
-        return {
+def invalidate_user_ability(user_id: str):
+    """Drop the cached ability estimate for a user after new progress is recorded."""
+    _ability_cache.pop(user_id, None)
+    _ability_generation[user_id] = next(_ability_generation_counter)
+
+async def _compute_user_ability(user_id: str):
+    """
+    Estimate a user's overall and per-topic ability from their progress history.
+    
+    The last estimate is persisted in user_abilities together with the level counts
+    it was computed from and the id of the newest progress row it includes, so only
+    progress recorded since then is fetched and folded in.
+    """
+    cached = _ability_cache.get(user_id)
+    if cached is not None:
+        return cached
+    generation = _ability_generation.get(user_id)
+    
+    # Supabase calls are blocking, so run them in the threadpool to keep the event loop free.
+    # user_abilities has RLS enabled with no policies, so only the service-role client can use it
+    stored_response = await run_in_threadpool(
+        service_supabase.table("user_abilities")
+        .select("overall_ability,overall_confidence,topic_abilities,questions_answered,level_counts,last_seen_progress_id")
+        .eq("user_id", user_id)
+        .execute
+    )
+    stored = stored_response.data[0] if stored_response.data else None
+    last_seen_progress_id = stored["last_seen_progress_id"] if stored else 0
+    
+    # Load the user's responses recorded since the stored estimate
+    response = await run_in_threadpool(
+        supabase.table("user_progress")
+        .select("id,topic,correct,difficulty_level,timestamp")
+        .eq("user_id", user_id)
+        .gt("id", last_seen_progress_id)
+        .order("id")
+        .execute
+    )
+    new_answers = response.data or []
+    
+    if stored and not new_answers:
+        # Stored estimate is up to date
+        result = {
+            "user_id": user_id,
+            "overall_ability": stored["overall_ability"],
+            "overall_confidence": stored["overall_confidence"],
+            "topic_abilities": stored["topic_abilities"],
+            "questions_answered": stored["questions_answered"]
+        }
+    elif not new_answers:
+        result = {
             "user_id": user_id,
-            "overall_ability": overall_ability,
-            "overall_confidence": overall_confidence,
-            "topic_abilities": topic_abilities,
-            "questions_answered": len(overall_responses)
+            "overall_ability": INITIAL_ABILITY,
+            "topic_abilities": {},
+            "questions_answered": 0
         }
+    else:
+        stored_counts = stored["level_counts"] if stored else None
+        settled = _settled_answers(new_answers, datetime.utcnow() - PROGRESS_COMMIT_LAG)
+        settled_counts = _add_level_counts(settled, stored_counts) if settled else stored_counts
+        
+        if len(settled) == len(new_answers):
+            level_counts = settled_counts
+            result = settled_result = _abilities_from_counts(user_id, level_counts)
+        else:
+            level_counts = _add_level_counts(new_answers[len(settled):], settled_counts)
+            result = _abilities_from_counts(user_id, level_counts)
+            settled_result = _abilities_from_counts(user_id, settled_counts) if settled else None
+        
+        # Persist only the settled rows, so the stored estimate and watermark
+        # never skip a row that commits late
+        if settled:
+            await run_in_threadpool(service_supabase.table("user_abilities").upsert({
+                "user_id": user_id,
+                "overall_ability": settled_result["overall_ability"],
+                "overall_confidence": settled_result["overall_confidence"],
+                "topic_abilities": settled_result["topic_abilities"],
+                "questions_answered": settled_result["questions_answered"],
+                "level_counts": settled_counts,
+                "last_seen_progress_id": settled[-1]["id"],
+                "updated_at": datetime.utcnow().isoformat()
+            }, returning=ReturnMethod.minimal).execute)  # nothing is read back, so skip echoing the row
+    
+    if _ability_generation.get(user_id) == generation:
+        _ability_cache[user_id] = result
+    return result
+
+async def _compute_user_ability_for_topic(user_id: str, topic: str):
+    """
+    Estimate a user's ability for a single topic.
+    
+    Falls back to the overall ability when the topic has no responses.
+    """
+    abilities = await _compute_user_ability(user_id)
+    
+    if topic in abilities["topic_abilities"]:
+        return abilities["topic_abilities"][topic]["ability"]
+    
+    # If no data for this topic, use overall ability
+    return abilities["overall_ability"]
+
+def _recommend_for_ability(topic: str, topic_ability: float, challenge_mode: bool = False):
+    """
+    Build a difficulty recommendation from an already-computed topic ability.
+    """
+    # Add challenge if requested
+    if challenge_mode:
+        topic_ability += 0.5  # Bump up difficulty slightly
+    
+    # Convert to a target difficulty
+    target_difficulty = topic_ability  # For IRT, target_difficulty = ability for ~50% success
+    
+    # Convert to 1-5 scale
+    difficulty_level = irt_to_difficulty_level(target_difficulty)
+    
+    return {
+        "topic": topic,
+        "difficulty_level": difficulty_level,
+        "estimated_ability": topic_ability,
+        "challenge_mode": challenge_mode
+    }
+
+# Endpoints
+@router.get("/user-ability/{user_id}")
+async def get_user_ability(user_id: str):
+    """
+    Retrieve the ability level of a user, overall and by topic.
+    """
+    try:
+        return await _compute_user_ability(user_id)
         
     except Exception as e:
-        print(f"❌ Error calculating user ability: {str(e)}")
+        logger.exception("Error calculating user ability")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/recommend-difficulty")
@@ -354,36 +595,13 @@ async def recommend_difficulty(
     - challenge_mode: If True, recommend a slightly higher difficulty
     """
     try:
-        # Get the user's abilities
-        user_ability_response = await get_user_ability(user_id)
-        
-        # Extract the relevant ability
-        topic_ability = 0.0
-        if topic in user_ability_response["topic_abilities"]:
-            topic_ability = user_ability_response["topic_abilities"][topic]["ability"]
-        else:
-            # If no data for this topic, use overall ability
-            topic_ability = user_ability_response["overall_ability"]
-        
-        # Add challenge if requested
-        if challenge_mode:
-            topic_ability += 0.5  # Bump up difficulty slightly
-        
-        # Convert to a target difficulty
-        target_difficulty = topic_ability  # For IRT, target_difficulty = ability for ~50% success
-        
-        # Convert to 1-5 scale
-        difficulty_level = irt_to_difficulty_level(target_difficulty)
+        # Get the user's ability for this topic only
+        topic_ability = await _compute_user_ability_for_topic(user_id, topic)
         
-        return {
-            "topic": topic,
-            "difficulty_level": difficulty_level,
-            "estimated_ability": topic_ability,
-            "challenge_mode": challenge_mode
-        }
+        return _recommend_for_ability(topic, topic_ability, challenge_mode)
         
     except Exception as e:
-        print(f"❌ Error recommending difficulty: {str(e)}")
+        logger.exception("Error recommending difficulty")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/question-difficulty/{question_id}")
@@ -393,7 +611,9 @@ async def get_question_difficulty(question_id: str):
     """
     try:
         # Get all responses to this question
-        response = supabase.table("user_progress").select("*").eq("question_id", question_id).execute()
+        response = await run_in_threadpool(
+            supabase.table("user_progress").select("correct").eq("question_id", question_id).execute
+        )
         
         if not response.data:
             return {
@@ -404,12 +624,13 @@ async def get_question_difficulty(question_id: str):
                 "success_rate": 0
             }
         
-        # Extract the data
-        responses = [1 if answer.get("correct", False) else 0 for answer in response.data]
-        
-        # Calculate simple statistics
-        response_count = len(responses)
-        success_rate = sum(responses) / response_count if response_count > 0 else 0
+        # Calculate simple statistics in one pass, without an intermediate list
+        response_count = len(response.data)
+        correct_count = 0
+        for answer in response.data:
+            if answer.get("correct", False):
+                correct_count += 1
+        success_rate = correct_count / response_count if response_count > 0 else 0
         
         # Estimate difficulty based on success rate
         if success_rate < 0.2:
@@ -435,7 +656,7 @@ async def get_question_difficulty(question_id: str):
         }
         
     except Exception as e:
-        print(f"❌ Error getting question difficulty: {str(e)}")
+        logger.exception("Error getting question difficulty")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/adaptive-question")
@@ -449,8 +670,9 @@ async def get_adaptive_question(
     This combines the difficulty recommendation with question generation.
     """
     try:
-        # First, get the recommended difficulty
-        recommendation = await recommend_difficulty(user_id, topic, challenge_mode)
+        # First, get the recommended difficulty (one ability computation, no nested handler call)
+        topic_ability = await _compute_user_ability_for_topic(user_id, topic)
+        recommendation = _recommend_for_ability(topic, topic_ability, challenge_mode)
         
         # The ideal approach would be to select a question with appropriate difficulty
         # from a question bank. Since we're generating questions on-the-fly, we'll
@@ -466,5 +688,5 @@ async def get_adaptive_question(
         }
         
     except Exception as e:
-        print(f"❌ Error getting adaptive question: {str(e)}")
+        logger.exception("Error getting adaptive question")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
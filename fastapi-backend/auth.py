@@ -10,6 +10,8 @@ router = APIRouter()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Kept separate from the shared clients in deps.py: signing in stores the
+# user's session on the client and switches its PostgREST auth header
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 @router.post("/register")
@@ -0,0 +1,144 @@
+"""
+Supabase Insert Batching
+
+Buffers single-row inserts from request handlers and writes them to Supabase
+in bulk, so concurrent requests share one PostgREST round trip.
+"""
+
+import asyncio
+import logging
+from fastapi.concurrency import run_in_threadpool
+from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+def insert_query(client: Client, table: str, rows, columns: str = "*"):
+    """
+    Build an insert whose returned representation only carries the given columns.
+    postgrest-py's insert builder has no .select(), but PostgREST honours a
+    select parameter on inserts.
+    """
+    query = client.table(table).insert(rows)
+    if columns != "*":
+        query.params = query.params.add("select", columns)
+    return query
+
+class SupabaseBatcher:
+    """
+    Collects rows for up to max_wait_ms or max_batch rows, then inserts them
+    with one bulk insert per table and resolves each caller with its inserted row.
+    """
+
+    def __init__(self, client: Client, max_wait_ms: int = 25, max_batch: int = 100):
+        self.client = client
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._in_flight = 0
+
+    def start(self):
+        """Start the background flusher on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher once everything already queued has been written."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+
+    async def submit(self, table: str, row: dict, columns: str = "*") -> dict:
+        """
+        Insert a row and return it as stored by Supabase, limited to the given
+        columns (e.g. "id" when the caller only needs the new row's id).
+        """
+        # Fast path: with nothing else pending there is nothing to batch with,
+        # so insert directly instead of waiting out the batching window
+        if self._task is None or (self._queue.empty() and self._in_flight == 0):
+            self._in_flight += 1
+            try:
+                result = await run_in_threadpool(insert_query(self.client, table, row, columns).execute)
+            finally:
+                self._in_flight -= 1
+            return result.data[0] if result.data else None
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((table, row, columns, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+
+            # Rows being collected or written count as in flight, so new
+            # submissions join the next batch instead of taking the fast path
+            self._in_flight += 1
+            try:
+                stopping = False
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                await self._flush(batch)
+            finally:
+                self._in_flight -= 1
+
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        # PostgREST bulk inserts take their columns from the rows, so only rows
+        # with the same keys (and returned columns) can share a request
+        groups = {}
+        for table, row, columns, future in batch:
+            groups.setdefault((table, columns, frozenset(row)), []).append((row, future))
+
+        for (table, columns, _), items in groups.items():
+            rows = [row for row, _ in items]
+            try:
+                result = await run_in_threadpool(insert_query(self.client, table, rows, columns).execute)
+            except Exception as e:
+                if len(items) == 1:
+                    logger.error("❌ Error inserting row into %s: %s", table, e)
+                    _, future = items[0]
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                # One bad row (e.g. an invalid id or missing foreign key) fails the
+                # whole bulk insert, so retry row by row and only fail its own caller
+                logger.warning("Batch insert of %d rows into %s failed, retrying row by row: %s", len(rows), table, e)
+                await asyncio.gather(*(self._insert_one(table, row, columns, future) for row, future in items))
+                continue
+
+            data = result.data or []
+            for i, (_, future) in enumerate(items):
+                if not future.done():
+                    future.set_result(data[i] if i < len(data) else None)
+
+    async def _insert_one(self, table: str, row: dict, columns: str, future: asyncio.Future):
+        try:
+            result = await run_in_threadpool(insert_query(self.client, table, row, columns).execute)
+        except Exception as e:
+            logger.error("❌ Error inserting row into %s: %s", table, e)
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result.data[0] if result.data else None)
@@ -0,0 +1,89 @@
+"""
+Shared Dependencies
+
+Process-wide clients created once at import and shared by every router, so
+their HTTP connection pools stay warm across requests.
+"""
+
+import os
+import orjson
+import asyncpg
+from supabase import create_client, Client
+from postgrest.utils import SyncClient
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+DATABASE_URL = os.getenv("DATABASE_URL")  # optional direct (session mode) Postgres connection string
+
+# Keep-alive pool for PostgREST requests; HTTP/2 lets concurrent queries share
+# one connection instead of paying a TCP + TLS handshake each
+POSTGREST_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+def create_pooled_client(url: str, key: str) -> Client:
+    """
+    Create a Supabase client whose PostgREST session uses a pooled HTTP/2 connection.
+    """
+    client = create_client(url, key)
+
+    postgrest = client.postgrest
+    default_session = postgrest.session
+    postgrest.session = SyncClient(
+        base_url=default_session.base_url,
+        headers=default_session.headers,
+        timeout=default_session.timeout,
+        http2=True,
+        limits=POSTGREST_LIMITS,
+    )
+    default_session.close()
+
+    return client
+
+# Shared async HTTP/2 client for OpenAI calls, so every LangChain model draws
+# from one large keep-alive pool instead of its own small HTTP/1.1 pool
+openai_http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+)
+
+# Anon-key client for the performance, adaptive difficulty and leaderboard routers
+supabase: Client = create_pooled_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Service-role client for writes from main.py
+service_supabase: Client = create_pooled_client(SUPABASE_URL, SERVICE_KEY)
+
+# Direct Postgres pool for hot-path queries, created on startup when DATABASE_URL
+# is set. It skips the PostgREST HTTP + JSON hop; import the module and read
+# deps.db_pool, since it is None until init_db_pool has run.
+db_pool: asyncpg.Pool = None
+
+async def _init_connection(conn: asyncpg.Connection):
+    # Decode json/jsonb columns to Python objects, matching what PostgREST returns;
+    # orjson returns bytes, while asyncpg's text codec expects str
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=lambda value: orjson.dumps(value).decode(),
+            decoder=orjson.loads,
+            schema="pg_catalog"
+        )
+
+async def init_db_pool():
+    """Open the Postgres pool if DATABASE_URL is configured."""
+    global db_pool
+    if DATABASE_URL and db_pool is None:
+        db_pool = await asyncpg.create_pool(
+            DATABASE_URL, min_size=2, max_size=10, command_timeout=2, init=_init_connection
+        )
+
+async def close_db_pool():
+    """Close the Postgres pool if one was opened."""
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
@@ -1,19 +1,31 @@
-from fastapi import FastAPI, Query, HTTPException
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import JsonOutputParser
+from fastapi import FastAPI, Query, HTTPException, BackgroundTasks
+from langchain_openai import ChatOpenAI, OpenAI
 from langchain_core.prompts import PromptTemplate
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import os
+import re
+import asyncio
+import json
+import orjson
+import atexit
+import logging
+import queue
+import httpx
+import weakref
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field, validator
-from supabase import create_client, Client
-from datetime import datetime
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.llms import OpenAI
+from pydantic import BaseModel, Field, ValidationError, ValidationInfo, field_validator
+from collections import OrderedDict
+from cachetools import TTLCache
+from langchain.memory import ConversationBufferWindowMemory
+from langchain_community.chat_message_histories import RedisChatMessageHistory
 from typing import Optional, Dict
 from leaderboard import router as leaderboard_router
-from fastapi import BackgroundTasks
+import deps
+from deps import service_supabase, openai_http_client
+from batcher import SupabaseBatcher, insert_query
 
 
 
@@ -21,20 +33,31 @@ from fastapi import BackgroundTasks
 from performance_tracking import router as performance_router, EnhancedUserAnswer
 from adaptive_difficulty import router as adaptive_router
 # Import the functions directly from adaptive_difficulty
-from adaptive_difficulty import recommend_difficulty, get_user_ability
+from adaptive_difficulty import recommend_difficulty, invalidate_user_ability
 
 # Load API Keys & Supabase Credentials
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-SERVICE_KEY   = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-print("SERVICE_KEY prefix:", SERVICE_KEY[:15] if SERVICE_KEY else "None")
-
-supabase: Client = create_client(SUPABASE_URL, SERVICE_KEY)
-service_supabase = supabase                                   # reuse it
-
-app = FastAPI()
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+REDIS_URL = os.getenv("REDIS_URL")                            # optional, shares tutor chat history across workers
+supabase = service_supabase                                   # reuse the shared service-role client
+
+# Log through a queue so request handlers never block on writing to stdout;
+# a background listener thread does the actual I/O
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = QueueListener(log_queue, log_handler)
+logging.getLogger().addHandler(QueueHandler(log_queue))
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO"))
+logging.getLogger("httpx").setLevel(logging.WARNING)           # skip a line per Supabase/OpenAI request
+log_listener.start()
+atexit.register(log_listener.stop)                            # flush queued records on exit
+
+logger = logging.getLogger(__name__)
+
+# Serialize responses with orjson rather than the stdlib json encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS for Next.js
 app.add_middleware(
@@ -46,11 +69,62 @@ app.add_middleware(
 )
 ALLOWED_TOPICS = {"Algebra", "Geometry", "Grammar", "Reading Comprehension", "Trigonometry"}
 
+# Single-row inserts from the request handlers are coalesced into bulk inserts
+batcher = SupabaseBatcher(service_supabase)
+
+@app.on_event("startup")
+async def start_batcher():
+    batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+
+@app.on_event("startup")
+async def open_db_pool():
+    await deps.init_db_pool()
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    await deps.close_db_pool()
+
+@app.on_event("startup")
+async def warm_openai_connection():
+    # Open the TLS + HTTP/2 connection to OpenAI now so the first LLM call
+    # doesn't pay the handshake; any response, even 401, leaves it pooled
+    try:
+        await openai_http_client.head(OPENAI_BASE_URL, timeout=httpx.Timeout(5.0, connect=2.0))
+    except Exception as e:
+        logger.warning("Could not pre-connect to OpenAI: %s", e)
+
+@app.on_event("shutdown")
+async def close_openai_http_client():
+    await openai_http_client.aclose()
+
 # Include the routers
 app.include_router(performance_router, tags=["Performance Tracking"])
 app.include_router(adaptive_router, tags=["Adaptive Difficulty"])
 app.include_router(leaderboard_router, tags=["Leaderboard"])
 
+@app.on_event("startup")
+async def check_unique_routes():
+    # FastAPI silently serves the first of two handlers for the same method and
+    # path (e.g. a router redefining /submit-answer), so refuse to start instead
+    seen = set()
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            if (method, route.path) in seen:
+                raise RuntimeError(f"Duplicate route registered: {method} {route.path}")
+            seen.add((method, route.path))
+
+# Required answer choice keys and the first standalone number in a choice,
+# built once rather than on every validation
+REQUIRED_CHOICE_KEYS = frozenset({'A', 'B', 'C', 'D'})
+CHOICE_NUMBER_RE = re.compile(r'\b(\d+)\b')
+
+# Topics whose answer choices are prose, where the numeric solution check doesn't apply
+PROSE_TOPICS = frozenset({'Reading Comprehension', 'Grammar'})
+
 # Define the SAT Question Model with enhanced validation
 class SATQuestion(BaseModel):
     topic: str
@@ -62,12 +136,12 @@ class SATQuestion(BaseModel):
     passage: Optional[str] = None
     
     # Add validation for choices and correct_answer
-    @validator('choices')
+    @field_validator('choices')
+    @classmethod
     def validate_choices(cls, v):
         # Ensure choices contains exactly keys A, B, C, D
-        required_keys = {'A', 'B', 'C', 'D'}
-        if set(v.keys()) != required_keys:
-            raise ValueError(f"Choices must contain exactly keys {required_keys}")
+        if v.keys() != REQUIRED_CHOICE_KEYS:
+            raise ValueError(f"Choices must contain exactly keys {set(REQUIRED_CHOICE_KEYS)}")
         
         # Ensure choice values are not empty
         for key, value in v.items():
@@ -76,32 +150,38 @@ class SATQuestion(BaseModel):
         
         return v
     
-    @validator('correct_answer')
-    def validate_correct_answer(cls, v, values):
-        # Ensure correct_answer is one of the choices
+    @field_validator('correct_answer')
+    @classmethod
+    def validate_correct_answer(cls, v, info: ValidationInfo):
+        # Ensure correct_answer is one of the choices (info.data holds the fields validated so far)
+        values = info.data
         if 'choices' in values and v not in values['choices']:
             raise ValueError(f"Correct answer '{v}' must be one of the choices keys")
         return v
     
-    @validator('solution')
-    def validate_solution_consistency(cls, solution, values):
+    @field_validator('solution')
+    @classmethod
+    def validate_solution_consistency(cls, solution, info: ValidationInfo):
         """Validate that the solution is consistent with the correct answer."""
+        values = info.data
         if 'choices' not in values or 'correct_answer' not in values:
             return solution
+        if values.get('topic') in PROSE_TOPICS:
+            return solution
             
         correct_answer = values['correct_answer']
         correct_choice = values['choices'].get(correct_answer, '')
         
         # Basic consistency check - the correct answer value should appear in the solution
         # This is a heuristic and might need refinement
-        if correct_choice:
+        # (choices without any digit can't match, so skip the regex for them)
+        if correct_choice and any(c.isdigit() for c in correct_choice):
             # Extract just the number from the choice (assuming it's a number)
-            import re
-            match = re.search(r'\b(\d+)\b', correct_choice)
+            match = CHOICE_NUMBER_RE.search(correct_choice)
             if match:
                 number = match.group(1)
                 # Check if this number appears in the conclusion of the solution
-                if number not in solution.split('=')[-1]:
+                if number not in solution.rpartition('=')[2]:
                     raise ValueError(f"Solution appears inconsistent with correct answer '{correct_answer}': {correct_choice}")
         
         return solution
@@ -113,7 +193,7 @@ async def test_db_permissions():
         table_list = []
         for table in ["user_progress", "users", "auth.users"]:
             try:
-                result = supabase.table(table).select("*").limit(1).execute()
+                result = await run_in_threadpool(supabase.table(table).select("*").limit(1).execute)
                 table_list.append({"table": table, "status": "success", "data": result.data})
             except Exception as e:
                 table_list.append({"table": table, "status": "error", "error": str(e)})
@@ -122,26 +202,26 @@ async def test_db_permissions():
     except Exception as e:
         return {"error": str(e)}
     
-# Generate SAT Question + Hint Using LangChain with retry mechanism
-def generate_sat_question(topic: str, difficulty_level: int = 3, max_retries: int = 3) -> dict:
-    llm = ChatOpenAI(model_name="gpt-4o", openai_api_key=OPENAI_API_KEY, temperature=0.7)
-    parser = JsonOutputParser(pydantic_object=SATQuestion)
-
-    # Updated prompt to include difficulty level and clearer instructions for choices
-    difficulty_descriptions = {
-        1: "very easy (suitable for beginners)",
-        2: "somewhat easy (for review)",
-        3: "medium difficulty (standard SAT level)",
-        4: "challenging (for advanced students)",
-        5: "very challenging (for high-performers)"
-    }
-    
-    difficulty_desc = difficulty_descriptions.get(difficulty_level, "medium difficulty (standard SAT level)")
-    
-    # Create different templates based on topic
-    if topic == "Reading Comprehension":
-        prompt = PromptTemplate(
-            template="""Generate a {difficulty} SAT Reading Comprehension question with the following format:
+# Question generation chain, built once at import and reused by every request
+# OpenAI JSON mode guarantees a JSON object, so the prompt only needs the compact schema.
+# (Strict json_schema mode can't express the free-form choices dict.)
+question_llm = ChatOpenAI(model_name="gpt-4o", openai_api_key=OPENAI_API_KEY, temperature=0.7, max_retries=2,
+                          http_async_client=openai_http_client) \
+    .bind(response_format={"type": "json_object"})
+question_format_instructions = "Respond with a single JSON object that conforms to this JSON schema:\n" \
+    + json.dumps(SATQuestion.model_json_schema(), separators=(",", ":"))
+
+# Difficulty level descriptions used in the question prompts
+DIFFICULTY_DESCRIPTIONS = {
+    1: "very easy (suitable for beginners)",
+    2: "somewhat easy (for review)",
+    3: "medium difficulty (standard SAT level)",
+    4: "challenging (for advanced students)",
+    5: "very challenging (for high-performers)"
+}
+
+reading_question_prompt = PromptTemplate(
+    template="""Generate a {difficulty} SAT Reading Comprehension question with the following format:
 
 1. First, create a passage (about 200-300 words) on a topic suitable for SAT.
 2. Then, create a question about the passage.
@@ -159,12 +239,12 @@ IMPORTANT: Ensure that:
 - Each answer choice should be distinct and substantial
 
 {format_instructions}""",
-            input_variables=["difficulty"],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-    else:
-        prompt = PromptTemplate(
-            template="""Generate a {difficulty} multiple-choice SAT question about {topic}.
+    input_variables=["difficulty"],
+    partial_variables={"format_instructions": question_format_instructions},
+)
+
+question_prompt = PromptTemplate(
+    template="""Generate a {difficulty} multiple-choice SAT question about {topic}.
 
 REQUIREMENTS:
 1. Provide exactly four answer choices labeled A, B, C, D (use these exact keys).
@@ -180,47 +260,120 @@ IMPORTANT: Ensure that:
 - Each answer choice should be distinct and substantial
 
 {format_instructions}""",
-            input_variables=["topic", "difficulty"],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
+    input_variables=["topic", "difficulty"],
+    partial_variables={"format_instructions": question_format_instructions},
+)
+
+def parse_generated_question(response) -> dict:
+    """
+    Parse and validate an LLM reply as a SATQuestion.
+    Raises pydantic ValidationError if the reply is not a valid question.
+    """
+    # Parse and validate the JSON in one step - this will run the validators
+    return SATQuestion.model_validate_json(response.content).model_dump()
+
+# Attempts per question. Only replies that fail validation are regenerated;
+# OpenAI rate limits and timeouts are already retried by the client (max_retries)
+QUESTION_GENERATION_ATTEMPTS = 3
+
+def validated_question_chain(prompt: PromptTemplate):
+    """Build a chain that returns a validated question dict, regenerating invalid replies."""
+    return (prompt | question_llm | parse_generated_question).with_retry(
+        retry_if_exception_type=(ValidationError,),
+        wait_exponential_jitter=False,
+        stop_after_attempt=QUESTION_GENERATION_ATTEMPTS,
+    )
+
+reading_question_chain = validated_question_chain(reading_question_prompt)
+question_chain = validated_question_chain(question_prompt)
+
+# Chain and fixed prompt inputs per topic, so generation is a single lookup.
+# Reading Comprehension writes its own passage and takes no topic input.
+QUESTION_CHAINS = {
+    topic: (reading_question_chain, {}) if topic == "Reading Comprehension" else (question_chain, {"topic": topic})
+    for topic in ALLOWED_TOPICS
+}
+
+# Generate SAT Question + Hint Using LangChain; invalid replies are retried by the chain
+async def generate_sat_question(topic: str, difficulty_level: int = 3) -> dict:
+    difficulty_desc = DIFFICULTY_DESCRIPTIONS.get(difficulty_level, "medium difficulty (standard SAT level)")
+    chain, chain_inputs = QUESTION_CHAINS.get(topic) or (question_chain, {"topic": topic})
+
+    try:
+        question_data = await chain.ainvoke({**chain_inputs, "difficulty": difficulty_desc})
+    except ValidationError as e:
+        logger.warning("Failed to generate valid question after %d attempts: %s", QUESTION_GENERATION_ATTEMPTS, e)
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Failed to generate a valid question: {str(e)}"
         )
 
-    # Implement retry logic
-    for attempt in range(max_retries):
-        try:
-            # Invoke LLM with appropriate parameters
-            if topic == "Reading Comprehension":
-                response_dict = (prompt | llm | parser).invoke({"difficulty": difficulty_desc})
-            else:
-                response_dict = (prompt | llm | parser).invoke({
-                    "topic": topic, 
-                    "difficulty": difficulty_desc
-                })
-
-            # Convert to Pydantic model - this will run the validators
-            question_obj = SATQuestion(**response_dict)
-            question_data = question_obj.dict()
-
-            # Add metadata about the difficulty level
-            question_data["difficulty_level"] = difficulty_level
-            
-            result = supabase.table("questions").insert(question_data).execute()
+    # Add metadata about the difficulty level
+    question_data["difficulty_level"] = difficulty_level
+    
+    inserted = await batcher.submit("questions", question_data, columns="id")
 
-            if not result.data:
-                raise HTTPException(status_code=500, detail="Failed to insert question into database.")
+    if not inserted:
+        raise HTTPException(status_code=500, detail="Failed to insert question into database.")
 
-            inserted_id = result.data[0]["id"]  # Ensure Supabase returns the ID
+    question_data["question_id"] = inserted["id"]
+    cache_question_details(inserted["id"], question_data["question"], question_data["choices"])
+    return question_data
 
-            question_data["question_id"] = inserted_id
-            return question_data
-            
-        except (ValueError, HTTPException) as e:
-            if attempt == max_retries - 1:  # Last attempt
-                print(f"Failed to generate valid question after {max_retries} attempts: {str(e)}")
-                raise HTTPException(
-                    status_code=500, 
-                    detail=f"Failed to generate a valid question: {str(e)}"
-                )
-            print(f"Attempt {attempt+1} failed: {str(e)}. Retrying...")
+# Pre-generated questions per (topic, difficulty_level), topped up in the background
+# for combinations that have been requested, plus the generations currently running
+QUESTION_POOL_SIZE = 4
+question_pools: Dict[tuple, asyncio.Queue] = {}
+pool_refills: Dict[tuple, asyncio.Task] = {}
+inflight_questions: Dict[tuple, asyncio.Future] = {}
+
+async def generate_shared_question(topic: str, difficulty_level: int) -> dict:
+    """
+    Generate a question, letting concurrent requests for the same topic and
+    difficulty share a single LLM call instead of each starting their own.
+    """
+    key = (topic, difficulty_level)
+    future = inflight_questions.get(key)
+    if future is None:
+        future = asyncio.ensure_future(generate_sat_question(topic, difficulty_level))
+        inflight_questions[key] = future
+        future.add_done_callback(lambda _: inflight_questions.pop(key, None))
+    
+    # Shield so one client disconnecting doesn't cancel the generation for the others
+    return await asyncio.shield(future)
+
+async def refill_question_pool(key: tuple):
+    pool = question_pools[key]
+    try:
+        while not pool.full():
+            pool.put_nowait(await generate_sat_question(*key))
+    except Exception:
+        logger.exception("Error refilling question pool for %s", key)
+    finally:
+        pool_refills.pop(key, None)
+
+async def get_question(topic: str, difficulty_level: int) -> dict:
+    """
+    Serve a pre-generated question if one is ready, otherwise generate one.
+    """
+    key = (topic, difficulty_level)
+    pool = question_pools.setdefault(key, asyncio.Queue(maxsize=QUESTION_POOL_SIZE))
+    
+    try:
+        question_data = pool.get_nowait()
+    except asyncio.QueueEmpty:
+        question_data = await generate_shared_question(topic, difficulty_level)
+    
+    if key not in pool_refills:
+        pool_refills[key] = asyncio.create_task(refill_question_pool(key))
+    
+    # Callers may add fields to the response, and shared generations hand the same dict to several requests
+    return dict(question_data)
+
+@app.on_event("shutdown")
+async def stop_question_pools():
+    for task in list(pool_refills.values()):
+        task.cancel()
 
 @app.get("/generate-question")
 async def generate_question(
@@ -241,13 +394,13 @@ async def generate_question(
                 challenge_mode=False
             )
             difficulty_level = recommendation["difficulty_level"]
-            print(f"Using adaptive difficulty level {difficulty_level} for user {user_id}")
+            logger.info("Using adaptive difficulty level %s for user %s", difficulty_level, user_id)
         except Exception as e:
-            print(f"Error getting adaptive difficulty: {str(e)}")
+            logger.warning("Error getting adaptive difficulty: %s", e)
             # Fall back to default difficulty
             pass
     
-    return generate_sat_question(topic, difficulty_level)
+    return await get_question(topic, difficulty_level)
 
 @app.get("/generate-adaptive-question")
 async def generate_adaptive_question(
@@ -271,7 +424,7 @@ async def generate_adaptive_question(
         )
         
         # Generate a question with the recommended difficulty
-        question_data = generate_sat_question(topic, recommendation["difficulty_level"])
+        question_data = await get_question(topic, recommendation["difficulty_level"])
         
         # Add adaptive info to the response
         question_data["adaptive_info"] = {
@@ -283,21 +436,85 @@ async def generate_adaptive_question(
         return question_data
         
     except Exception as e:
-        print(f"Error generating adaptive question: {str(e)}")
+        logger.exception("Error generating adaptive question")
         raise HTTPException(status_code=500, detail=f"Failed to generate adaptive question: {str(e)}")
 
-@app.get("/generate-hint")
-async def generate_hint(topic: str = Query(..., title="SAT Topic"), question: str = Query(..., title="SAT Question")):
-    llm = ChatOpenAI(model_name="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY)
+# Limits for /generate-questions: questions per request, and LLM calls in flight at once
+MAX_BULK_QUESTIONS = 20
+BULK_GENERATION_CONCURRENCY = 8
 
-    hint_prompt = PromptTemplate(
-        template="Provide a helpful hint for solving this SAT question: {question}. "
-                 "Do not give away the answer, just a guiding clue.",
-        input_variables=["question"],
+class BulkQuestionRequest(BaseModel):
+    topic: str
+    difficulty_level: int = Field(3, ge=1, le=5)
+    count: int = Field(5, ge=1, le=MAX_BULK_QUESTIONS)
+
+@app.post("/generate-questions")
+async def generate_questions(request: BulkQuestionRequest):
+    """
+    Generate several questions for one topic and difficulty at once. The LLM
+    calls run concurrently and all questions are stored with one bulk insert.
+    """
+    if request.topic not in ALLOWED_TOPICS:
+        raise HTTPException(status_code=400, detail="Invalid topic. Choose an SAT-relevant subject.")
+    
+    chain, chain_inputs = QUESTION_CHAINS[request.topic]
+    inputs = {**chain_inputs, "difficulty": DIFFICULTY_DESCRIPTIONS[request.difficulty_level]}
+    
+    # The chain regenerates invalid replies itself; drop any still failing after that.
+    # Each question is its own ainvoke: RunnableRetry.abatch can hand retried
+    # results back in the wrong positions.
+    semaphore = asyncio.Semaphore(BULK_GENERATION_CONCURRENCY)
+
+    async def generate_one():
+        async with semaphore:
+            return await chain.ainvoke(inputs)
+
+    responses = await asyncio.gather(
+        *(generate_one() for _ in range(request.count)),
+        return_exceptions=True
     )
+    questions = []
+    for response in responses:
+        if isinstance(response, Exception):
+            logger.warning("Discarding generated question: %s", response)
+            continue
+        response["difficulty_level"] = request.difficulty_level
+        questions.append(response)
+    
+    if not questions:
+        raise HTTPException(status_code=500, detail="Failed to generate any valid questions.")
+    
+    try:
+        result = await run_in_threadpool(insert_query(supabase, "questions", questions, columns="id").execute)
+    except Exception as e:
+        logger.exception("Error inserting generated questions")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not result.data or len(result.data) != len(questions):
+        raise HTTPException(status_code=500, detail="Failed to insert questions into database.")
+    
+    # PostgREST returns inserted rows in input order
+    for question_data, row in zip(questions, result.data):
+        question_data["question_id"] = row["id"]
+        cache_question_details(row["id"], question_data["question"], question_data["choices"])
+    
+    return {"questions": questions}
 
-    response = hint_prompt | llm
-    hint_response = response.invoke({"question": question})
+# Hint chain, built once at import and reused by every request
+hint_llm = ChatOpenAI(model_name="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY, max_retries=2,
+                      http_async_client=openai_http_client)
+
+hint_prompt = PromptTemplate(
+    template="Provide a helpful hint for solving this SAT question: {question}. "
+             "Do not give away the answer, just a guiding clue.",
+    input_variables=["question"],
+)
+
+hint_chain = hint_prompt | hint_llm
+
+@app.get("/generate-hint")
+async def generate_hint(topic: str = Query(..., title="SAT Topic"), question: str = Query(..., title="SAT Question")):
+    hint_response = await hint_chain.ainvoke({"question": question})
 
     if isinstance(hint_response, dict) and "content" in hint_response:
         hint_text = hint_response["content"]
@@ -309,111 +526,107 @@ async def generate_hint(topic: str = Query(..., title="SAT Topic"), question: st
     return {"hint": hint_text}
 
 @app.post("/submit-answer")
-async def submit_answer(answer: EnhancedUserAnswer):
+async def submit_answer(answer: EnhancedUserAnswer, background_tasks: BackgroundTasks):
     try:
-        print("📌 Received Answer Submission:", answer.dict())
-
-        answer_dict = answer.dict(exclude={"timestamp"})
-        answer_dict["timestamp"] = datetime.utcnow().isoformat()
-
-        response = service_supabase.table("user_progress").insert(answer_dict).execute()
+        # Serialize once; the debug log reuses the row being inserted
+        answer_dict = answer.model_dump(exclude={"timestamp"})
+        logger.debug("📌 Received Answer Submission: %s", answer_dict)
+
+        # The timestamp column defaults to now() in Postgres
+        if deps.db_pool is not None:
+            columns = ", ".join(f'"{column}"' for column in answer_dict)
+            placeholders = ", ".join(f"${i}" for i in range(1, len(answer_dict) + 1))
+            inserted = await deps.db_pool.fetchrow(
+                f"insert into user_progress ({columns}) values ({placeholders}) returning id",
+                *answer_dict.values()
+            )
+        else:
+            inserted = await batcher.submit("user_progress", answer_dict, columns="id")
 
         # Check for database errors
-        if response.data and isinstance(response.data, dict) and "error" in response.data:
-            raise HTTPException(status_code=500, detail=response.data["error"])
+        if not inserted:
+            raise HTTPException(status_code=500, detail="Failed to record answer in database.")
 
-        background_tasks = BackgroundTasks()
-        background_tasks.add_task(update_leaderboard_entry, answer.user_id)
+        # The user's ability estimate is stale once a new answer is recorded
+        invalidate_user_ability(answer.user_id)
+
+        # FastAPI runs this after the response has been sent
+        background_tasks.add_task(
+            update_leaderboard_entry, answer.user_id, answer.correct, answer.difficulty_level
+        )
         
-        # Success! Now update leaderboard directly here rather than relying on a database trigger
         return {"message": "Answer recorded successfully!"}
 
     except Exception as e:
-        print("Error submitting answer:", str(e))
+        logger.exception("Error submitting answer")
         raise HTTPException(status_code=400, detail=str(e))
     
 
-async def update_leaderboard_entry(user_id):
+async def update_leaderboard_entry(user_id, correct, difficulty_level):
     try:
-        # Same implementation as before, but with extra error handling
-        progress_response = service_supabase.table("user_progress") \
-            .select("user_id,correct,difficulty_level") \
-            .eq("user_id", user_id) \
-            .execute()
-        
-        # Process data to calculate stats
-        total_questions = len(progress_response.data)
-        correct_answers = sum(1 for record in progress_response.data if record.get("correct", False))
-        difficulty_sum = sum(record.get("difficulty_level", 1) for record in progress_response.data)
-        points = sum(record.get("difficulty_level", 1) * 10 for record in progress_response.data if record.get("correct", False))
+        # Fold this one answer into the user's leaderboard row inside Postgres
+        await run_in_threadpool(service_supabase.rpc("increment_leaderboard", {
+            "p_user_id": user_id,
+            "p_correct": correct,
+            "p_difficulty": difficulty_level
+        }).execute)
         
-        # Calculate derived stats
-        accuracy = (correct_answers / total_questions * 100) if total_questions > 0 else 0
-        avg_difficulty = difficulty_sum / total_questions if total_questions > 0 else 0
-        
-        # Get existing email if possible
-        email_query = service_supabase.table("leaderboards").select("email").eq("user_id", user_id).execute()
-        email = email_query.data[0]["email"] if email_query.data else "Anonymous"
-        
-        # Update leaderboard
-        service_supabase.table("leaderboards").upsert({
-            "user_id": user_id,
-            "email": email,
-            "total_questions": total_questions,
-            "correct_answers": correct_answers,
-            "accuracy": accuracy,
-            "avg_difficulty": avg_difficulty,
-            "total_points": points,
-            "updated_at": datetime.utcnow().isoformat()
-        }).execute()
-        
-        print(f"Successfully updated leaderboard for user {user_id}")
-    except Exception as e:
-        print(f"Error updating leaderboard for user {user_id}: {str(e)}")
+        logger.info("Successfully updated leaderboard for user %s", user_id)
+    except Exception:
+        logger.exception("Error updating leaderboard for user %s", user_id)
         # Log the error but don't propagate it
-# @app.post("/submit-answer")
-# async def submit_answer(answer: EnhancedUserAnswer):
-#     try:
-
-#         print(f"Authenticated User ID: {answer.user_id}")
-        
-#         # Additional validation
-#         if not answer.user_id:
-#             raise HTTPException(status_code=400, detail="Invalid user ID")
-
-#         print("📌 Received Answer Submission:", answer.dict())
-
-#         # Create a dict from the model, manually handling the timestamp
-#         answer_dict = answer.dict(exclude={"timestamp"})
-        
-#         # Add the current timestamp in ISO format
-#         answer_dict["timestamp"] = datetime.utcnow().isoformat()
-
-#         response = supabase.table("user_progress").insert(answer_dict).execute()
-
-#         if response.data and isinstance(response.data, dict) and "error" in response.data:
-#             raise HTTPException(status_code=500, detail=response.data["error"])
-
-#         return {"message": "Answer recorded successfully!"}
-
-#     except Exception as e:
-#         print("❌ Error submitting answer:", str(e))
-#         raise HTTPException(status_code=400, detail=str(e))
 
 class TutorChatRequest(BaseModel):
     user_id: str
     message: str
     question_id: str
 
-llm = OpenAI(temperature=0.7)
+llm = OpenAI(temperature=0.7, http_async_client=openai_http_client)
 
-# Memory store per user
-memory_dict = {}
+# Tutor memory bounds: exchanges kept in the prompt, Redis key TTL, users held in-process
+TUTOR_MEMORY_WINDOW = 10
+TUTOR_MEMORY_TTL = 3600
+MAX_TUTOR_MEMORIES = 1024
 
-# Define a tutoring prompt template
-prompt = PromptTemplate(
-    input_variables=["history", "question_text", "question_choices", "question"],
-    template="""
+# Memory store per user, evicting the least recently used user once full
+memory_dict = OrderedDict()
+
+def get_memory(user_id: str) -> ConversationBufferWindowMemory:
+    """
+    Get a user's tutor conversation memory, trimmed to the last few exchanges.
+    History lives in Redis when REDIS_URL is set, otherwise in this process.
+    """
+    memory = memory_dict.get(user_id)
+    if memory is not None:
+        memory_dict.move_to_end(user_id)
+        return memory
+    
+    if REDIS_URL:
+        history = RedisChatMessageHistory(session_id=user_id, url=REDIS_URL, ttl=TUTOR_MEMORY_TTL)
+        memory = ConversationBufferWindowMemory(k=TUTOR_MEMORY_WINDOW, chat_memory=history)
+    else:
+        memory = ConversationBufferWindowMemory(k=TUTOR_MEMORY_WINDOW)
+    
+    memory_dict[user_id] = memory
+    if len(memory_dict) > MAX_TUTOR_MEMORIES:
+        memory_dict.popitem(last=False)
+    return memory
+
+# Per-user locks so concurrent exchanges are saved one at a time; a lock is
+# dropped as soon as no request holds it, so this never outgrows active users
+memory_locks = weakref.WeakValueDictionary()
+
+def get_memory_lock(user_id: str) -> asyncio.Lock:
+    """Get the lock guarding writes to a user's tutor memory."""
+    lock = memory_locks.get(user_id)
+    if lock is None:
+        lock = memory_locks[user_id] = asyncio.Lock()
+    return lock
+
+# Define a tutoring prompt template. The instructions and question context come
+# first and stay byte-identical across turns on the same question, so the
+# provider's prompt-prefix cache can reuse them; per-turn text is appended last.
+TUTOR_PREFIX_TEMPLATE = """
     You are an SAT tutor. Help the student understand the given SAT question and their approach.
     
     SAT Question:
@@ -421,7 +634,9 @@ prompt = PromptTemplate(
     
     Choices:
     {question_choices}
-    
+    """
+
+TUTOR_TURN_TEMPLATE = """
     Previous Conversation:
     {history}
     
@@ -430,58 +645,111 @@ prompt = PromptTemplate(
     
     Response:
     """
+
+prompt = PromptTemplate(
+    input_variables=["history", "question_text", "question_choices", "question"],
+    template=TUTOR_PREFIX_TEMPLATE + TUTOR_TURN_TEMPLATE
 )
 
-# LangChain LLM Chain
-llm_chain = LLMChain(llm=llm, prompt=prompt)
+# Tutor chain, built once and shared by /tutor-chat (ainvoke) and /tutor-chat/stream (astream)
+tutor_chain = prompt | llm
+
+# Question rows never change after insert, so tutor turns can reuse them
+QUESTION_CACHE_TTL = 3600
+_question_cache = TTLCache(maxsize=10_000, ttl=QUESTION_CACHE_TTL)
 
-def fetch_question_details(question_id: str):
+def cache_question_details(question_id, question: str, choices) -> dict:
+    """
+    Store a question in the tutor format and return it. Generation calls this
+    right after insert, so the first tutor turn on a new question skips the database.
+    """
+    # A text/json choices column comes back as a JSON string rather than a dict
+    if isinstance(choices, (str, bytes)):
+        choices = orjson.loads(choices)
+    question_data = {
+        "question_text": question,
+        # Serialize with sorted keys so the prompt prefix is identical on every turn
+        "question_choices": json.dumps(choices, sort_keys=True)
+    }
+    # Tutor requests carry the id as a string
+    _question_cache[str(question_id)] = question_data
+    return question_data
+
+async def fetch_question_details(question_id: str):
     """
     Fetch the full question details from Supabase using question_id.
     """
+    cached = _question_cache.get(question_id)
+    if cached is not None:
+        return cached
+    
     try:
-        response = supabase.table("questions").select("*").eq("id", question_id).single().execute()
-        if response.data:
-            return {
-                "question_text": response.data["question"],
-                "question_choices": response.data["choices"]
-            }
+        if deps.db_pool is not None:
+            row = await deps.db_pool.fetchrow("select question, choices from questions where id = $1", question_id)
+        else:
+            response = await run_in_threadpool(
+                supabase.table("questions").select("question,choices").eq("id", question_id).single().execute
+            )
+            row = response.data
+        if row:
+            return cache_question_details(question_id, row["question"], row["choices"])
         else:
             return None
     except Exception as e:
-        print(f"Error fetching question details: {e}")
+        logger.warning("Error fetching question details: %s", e)
         return None
 
+async def load_history(user_id: str):
+    """
+    Get a user's tutor memory along with its formatted conversation history.
+    """
+    memory = get_memory(user_id)
+    variables = await run_in_threadpool(memory.load_memory_variables, {})
+    return memory, variables.get("history", "")
+
+async def persist_chat(memory: ConversationBufferWindowMemory, chat_data: dict):
+    """
+    Save a tutor exchange to memory and Supabase after the response has been sent.
+    """
+    try:
+        # Update memory with latest conversation, keeping each exchange's
+        # question and answer together when the user has several in flight
+        async with get_memory_lock(chat_data["user_id"]):
+            await run_in_threadpool(
+                memory.save_context,
+                {"input": chat_data["user_message"]},
+                {"output": chat_data["tutor_response"]}
+            )
+        
+        # Store chat with question_id reference
+        inserted = await batcher.submit("tutor_chat", chat_data, columns="id")
+        if not inserted:
+            logger.error("Failed to store chat in database for user %s", chat_data["user_id"])
+    except Exception:
+        logger.exception("Error persisting chat for user %s", chat_data["user_id"])
+
 @app.post("/tutor-chat")
-async def tutor_chat(request: TutorChatRequest):
+async def tutor_chat(request: TutorChatRequest, background_tasks: BackgroundTasks):
     """
     Uses LangChain Memory to generate an AI response, stores chat in Supabase, and links to the generated SAT question.
     """
     try:
-        # Fetch question details
-        question_data = fetch_question_details(request.question_id)
+        # Fetch question details and conversation memory concurrently
+        question_data, (memory, history) = await asyncio.gather(
+            fetch_question_details(request.question_id),
+            load_history(request.user_id)
+        )
         if not question_data:
             raise HTTPException(status_code=404, detail="Question not found")
 
-        # Retrieve conversation memory (or initialize if missing)
-        if request.user_id not in memory_dict:
-            memory_dict[request.user_id] = ConversationBufferMemory()
-        
-        memory = memory_dict[request.user_id]
-        history = memory.load_memory_variables({}).get("history", "")
-
         # Generate AI response with full question context
-        ai_response = llm_chain.run({
+        ai_response = await tutor_chain.ainvoke({
             "history": history,
             "question_text": question_data["question_text"],
             "question_choices": question_data["question_choices"],
             "question": request.message
         })
 
-        # Update memory with latest conversation
-        memory.save_context({"input": request.message}, {"output": ai_response})
-
-        # Store chat with question_id reference
         chat_data = {
             "user_id": request.user_id,
             "question_id": request.question_id,
@@ -489,24 +757,123 @@ async def tutor_chat(request: TutorChatRequest):
             "tutor_response": ai_response
         }
 
-        result = supabase.table("tutor_chat").insert(chat_data).execute()
+        # Memory and database writes don't need to hold up the response
+        background_tasks.add_task(persist_chat, memory, chat_data)
         
-        if result.data:
-            return {"user_message": request.message, "tutor_response": ai_response}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to store chat in database")
+        return {"user_message": request.message, "tutor_response": ai_response}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a Server-Sent Events message with a JSON payload."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
+
+@app.post("/tutor-chat/stream")
+async def tutor_chat_stream(request: TutorChatRequest, background_tasks: BackgroundTasks):
+    """
+    Streams the tutor response as Server-Sent Events while it is generated.
+    Sends {"token": ...} messages, then a "done" event with the full response.
+    """
+    try:
+        question_data, (memory, history) = await asyncio.gather(
+            fetch_question_details(request.question_id),
+            load_history(request.user_id)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if not question_data:
+        raise HTTPException(status_code=404, detail="Question not found")
+
+    async def token_stream():
+        chunks = []
+        try:
+            async for chunk in tutor_chain.astream({
+                "history": history,
+                "question_text": question_data["question_text"],
+                "question_choices": question_data["question_choices"],
+                "question": request.message
+            }):
+                chunks.append(chunk)
+                yield sse_event({"token": chunk})
+        except Exception as e:
+            logger.exception("Error streaming tutor response")
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+
+        ai_response = "".join(chunks)
+        # Background tasks run once the stream has been fully sent
+        background_tasks.add_task(persist_chat, memory, {
+            "user_id": request.user_id,
+            "question_id": request.question_id,
+            "user_message": request.message,
+            "tutor_response": ai_response
+        })
+        yield sse_event({"user_message": request.message, "tutor_response": ai_response}, event="done")
+
+    # Reverse proxies (e.g. nginx) buffer responses by default, which would hold
+    # tokens back until the reply is complete
+    return StreamingResponse(
+        token_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=background_tasks
+    )
+
+# Page size limits for /user-chat
+DEFAULT_CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
 
 @app.get("/user-chat")
-async def get_user_chat(user_id: str = Query(...)):
+async def get_user_chat(
+    user_id: str = Query(...),
+    limit: int = Query(DEFAULT_CHAT_PAGE_SIZE, ge=1, le=MAX_CHAT_PAGE_SIZE, title="Messages per page"),
+    before: Optional[int] = Query(None, title="Only return messages older than this chat id")
+):
     """
-    Fetch chat history for a user from Supabase.
+    Fetch a page of chat history for a user from Supabase, oldest first.
+    Pass the first message's id as `before` to load the page before it.
     """
     try:
-        response = supabase.table("tutor_chat").select("*").eq("user_id", user_id).execute()
-        return response.data or []
+        # Newest messages first so the (user_id, id desc) index serves the page
+        query = supabase.table("tutor_chat") \
+            .select("id,user_message,tutor_response,created_at") \
+            .eq("user_id", user_id) \
+            .order("id", desc=True) \
+            .limit(limit)
+        if before is not None:
+            query = query.lt("id", before)
+        
+        response = await run_in_threadpool(query.execute)
+        # Return the page in chronological order for display
+        return (response.data or [])[::-1]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
\ No newline at end of file
+    
+if __name__ == "__main__":
+    import uvicorn
+
+    # Tutor chat memory lives in each worker process unless REDIS_URL is set, so
+    # consecutive turns landing on different workers would lose the conversation.
+    # Run a single worker by default without Redis, and refuse more than one.
+    workers = int(os.getenv("WEB_CONCURRENCY", "4" if REDIS_URL else "1"))
+    if workers > 1 and not REDIS_URL:
+        raise SystemExit("WEB_CONCURRENCY > 1 requires REDIS_URL so tutor chat memory is shared across workers")
+
+    # uvloop and httptools replace the pure-Python event loop and HTTP parser.
+    # With more than one worker, cached abilities may lag by up to their TTL on
+    # the workers that didn't record the answer.
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=512,
+        backlog=2048,
+    )
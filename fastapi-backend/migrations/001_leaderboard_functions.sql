@@ -0,0 +1,63 @@
+-- Leaderboard aggregation functions
+--
+-- Aggregates user_progress per user inside Postgres so the API only receives
+-- the top `lim` pre-ranked rows instead of every progress record.
+-- Called from leaderboard.py via supabase.rpc(...).
+
+create or replace function leaderboard_global(lim integer default 10)
+returns table (
+    user_id text,
+    email text,
+    total_questions bigint,
+    correct_answers bigint,
+    accuracy double precision,
+    avg_difficulty double precision,
+    total_points bigint
+)
+language sql stable
+as $$
+    select
+        p.user_id::text,
+        coalesce(max(l.email), 'Anonymous'),
+        count(*),
+        count(*) filter (where p.correct),
+        100.0 * count(*) filter (where p.correct) / count(*),
+        avg(coalesce(p.difficulty_level, 1))::double precision,
+        coalesce(sum(coalesce(p.difficulty_level, 1) * 10) filter (where p.correct), 0)
+    from user_progress p
+    left join leaderboards l on l.user_id = p.user_id
+    group by p.user_id
+    order by 7 desc
+    limit lim;
+$$;
+
+create or replace function leaderboard_by_topic(topic_name text, lim integer default 10)
+returns table (
+    user_id text,
+    email text,
+    total_questions bigint,
+    correct_answers bigint,
+    accuracy double precision,
+    avg_difficulty double precision,
+    total_points bigint
+)
+language sql stable
+as $$
+    select
+        p.user_id::text,
+        coalesce(max(l.email), 'Anonymous'),
+        count(*),
+        count(*) filter (where p.correct),
+        100.0 * count(*) filter (where p.correct) / count(*),
+        avg(coalesce(p.difficulty_level, 1))::double precision,
+        coalesce(sum(coalesce(p.difficulty_level, 1) * 10) filter (where p.correct), 0)
+    from user_progress p
+    left join leaderboards l on l.user_id = p.user_id
+    where p.topic = topic_name
+    group by p.user_id
+    order by 7 desc
+    limit lim;
+$$;
+
+create index if not exists user_progress_topic_user_id_idx
+    on user_progress (topic, user_id);
@@ -0,0 +1,19 @@
+-- Covering indexes for the user_progress read paths
+--
+-- Each index carries the columns its query reads (INCLUDE), so Postgres can
+-- answer with an index-only scan instead of a sequential scan:
+--   * ability estimation:  filter on user_id, reads topic/correct/difficulty_level
+--   * topic leaderboard:   filter on topic, reads user_id/correct/difficulty_level
+--   * question difficulty: filter on question_id, reads correct
+
+create index if not exists user_progress_user_id_topic_idx
+    on user_progress (user_id, topic) include (correct, difficulty_level);
+
+create index if not exists user_progress_topic_idx
+    on user_progress (topic) include (user_id, correct, difficulty_level);
+
+create index if not exists user_progress_question_id_idx
+    on user_progress (question_id) include (correct);
+
+-- Superseded by user_progress_topic_idx
+drop index if exists user_progress_topic_user_id_idx;
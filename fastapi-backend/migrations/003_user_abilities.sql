@@ -0,0 +1,28 @@
+-- Persisted ability estimates
+--
+-- One row per user holding the last ability estimate returned by
+-- /user-ability, the per-topic answered/correct counts by difficulty level it
+-- was computed from, and the id of the newest user_progress row included.
+-- adaptive_difficulty.py only fetches progress rows with a larger id and folds
+-- them into level_counts, so estimation cost follows new answers rather than
+-- the user's whole history.
+
+create table if not exists user_abilities (
+    user_id text primary key,
+    overall_ability double precision not null,
+    overall_confidence double precision not null,
+    topic_abilities jsonb not null default '{}'::jsonb,
+    questions_answered integer not null default 0,
+    level_counts jsonb not null default '{}'::jsonb,
+    last_seen_progress_id bigint not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+-- Only the API writes estimates, through the service-role key (which bypasses
+-- RLS). With RLS on and no policies, the public anon key can't read or overwrite
+-- another user's counts or watermark.
+alter table user_abilities enable row level security;
+
+-- Serves the "progress since last_seen_progress_id" lookup
+create index if not exists user_progress_user_id_id_idx
+    on user_progress (user_id, id);
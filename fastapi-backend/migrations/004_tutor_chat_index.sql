@@ -0,0 +1,8 @@
+-- Chat history pagination
+--
+-- /user-chat reads a user's newest messages first and pages back with a
+-- "before" cursor on id, so this index turns each page into a short index
+-- range scan instead of a sequential scan of tutor_chat.
+
+create index if not exists tutor_chat_user_id_id_idx
+    on tutor_chat (user_id, id desc);
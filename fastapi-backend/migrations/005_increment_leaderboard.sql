@@ -0,0 +1,62 @@
+-- Incremental leaderboard updates
+--
+-- Folds one submitted answer into the user's leaderboards row, so
+-- /submit-answer does O(1) work instead of re-reading the user's whole
+-- user_progress history. accuracy and avg_difficulty are kept as running
+-- values derived from the updated counters.
+-- Called from main.py via supabase.rpc("increment_leaderboard", ...).
+
+create or replace function increment_leaderboard(
+    p_user_id uuid,
+    p_correct boolean,
+    p_difficulty integer default 1
+)
+returns void
+language sql
+as $$
+    insert into leaderboards as l (
+        user_id, email, total_questions, correct_answers,
+        accuracy, avg_difficulty, total_points, updated_at
+    )
+    values (
+        p_user_id,
+        'Anonymous',
+        1,
+        case when p_correct then 1 else 0 end,
+        case when p_correct then 100.0 else 0 end,
+        coalesce(p_difficulty, 1),
+        case when p_correct then coalesce(p_difficulty, 1) * 10 else 0 end,
+        now()
+    )
+    on conflict (user_id) do update set
+        total_questions = l.total_questions + 1,
+        correct_answers = l.correct_answers + excluded.correct_answers,
+        accuracy = 100.0 * (l.correct_answers + excluded.correct_answers) / (l.total_questions + 1),
+        avg_difficulty = (l.avg_difficulty * l.total_questions + excluded.avg_difficulty) / (l.total_questions + 1),
+        total_points = l.total_points + excluded.total_points,
+        updated_at = excluded.updated_at;
+$$;
+
+-- One-off backfill so counters start from each user's existing history
+insert into leaderboards (
+    user_id, email, total_questions, correct_answers,
+    accuracy, avg_difficulty, total_points, updated_at
+)
+select
+    p.user_id,
+    'Anonymous',
+    count(*),
+    count(*) filter (where p.correct),
+    100.0 * count(*) filter (where p.correct) / count(*),
+    avg(coalesce(p.difficulty_level, 1)),
+    coalesce(sum(coalesce(p.difficulty_level, 1) * 10) filter (where p.correct), 0),
+    now()
+from user_progress p
+group by p.user_id
+on conflict (user_id) do update set
+    total_questions = excluded.total_questions,
+    correct_answers = excluded.correct_answers,
+    accuracy = excluded.accuracy,
+    avg_difficulty = excluded.avg_difficulty,
+    total_points = excluded.total_points,
+    updated_at = excluded.updated_at;
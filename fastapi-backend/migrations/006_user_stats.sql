@@ -0,0 +1,28 @@
+-- Per-topic answer statistics
+--
+-- Aggregates a user's user_progress rows by topic inside Postgres, so
+-- /user-stats receives one row per topic instead of every answer. sum_time and
+-- count_time only cover answers with a recorded time_taken.
+-- Called from performance_tracking.py via supabase.rpc("user_stats", ...).
+
+create or replace function user_stats(uid uuid)
+returns table (
+    topic text,
+    total bigint,
+    correct bigint,
+    sum_time double precision,
+    count_time bigint
+)
+language sql stable
+as $$
+    select
+        p.topic,
+        count(*),
+        count(*) filter (where p.correct),
+        coalesce(sum(p.time_taken), 0)::double precision,
+        count(p.time_taken)
+    from user_progress p
+    where p.user_id = uid
+    group by p.topic
+    order by min(p.id);
+$$;
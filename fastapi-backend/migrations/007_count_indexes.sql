@@ -0,0 +1,16 @@
+-- Indexes for count and per-user aggregate queries
+--
+--   * user ranking:  counts leaderboards rows with more total_points than the
+--                    user, served by an index range scan on total_points
+--   * user_stats():  filter on user_id, groups by topic and reads
+--                    correct/time_taken, so time_taken joins the covering
+--                    columns and the whole aggregate is an index-only scan
+
+create index if not exists leaderboards_total_points_idx
+    on leaderboards (total_points);
+
+create index if not exists user_progress_user_id_topic_stats_idx
+    on user_progress (user_id, topic) include (correct, difficulty_level, time_taken);
+
+-- Superseded by user_progress_user_id_topic_stats_idx
+drop index if exists user_progress_user_id_topic_idx;
@@ -0,0 +1,8 @@
+-- Server-side answer timestamps
+--
+-- /submit-answer no longer sends a timestamp; Postgres stamps each
+-- user_progress row on insert, so the API skips formatting one per request
+-- and timestamps don't depend on the API hosts' clocks.
+
+alter table user_progress
+    alter column "timestamp" set default now();
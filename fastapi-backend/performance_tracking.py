@@ -1,18 +1,13 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from fastapi import APIRouter, HTTPException
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from deps import supabase
 from typing import Optional
+from uuid import UUID
+import logging
 
-# Load environment variables
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = logging.getLogger(__name__)
 
 # Create router
 router = APIRouter()
@@ -30,8 +25,11 @@ class EnhancedUserAnswer(BaseModel):
     # Make timestamp optional to avoid serialization issues
     timestamp: Optional[datetime] = None
 
-    class Config:
-        schema_extra = {
+    # Pydantic v2 serializes datetimes as ISO 8601 on its own, so no json_encoders needed
+    model_config = ConfigDict(
+        extra="forbid",
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "user_id": "user123",
                 "topic": "Algebra",
@@ -43,96 +41,57 @@ class EnhancedUserAnswer(BaseModel):
                 "difficulty_level": 3
             }
         }
-        # Add JSON serialization configuration
-        json_encoders = {
-            datetime: lambda dt: dt.isoformat()
-        }
+    )
 
-# Submit enhanced answer endpoint
-# @router.post("/submit-answer")
-# async def submit_answer(answer: EnhancedUserAnswer):
-#     try:
-#         # Create a dict from the model, manually handling the timestamp
-#         answer_dict = answer.dict(exclude={"timestamp"})
-        
-#         # Add the current timestamp in ISO format
-#         answer_dict["timestamp"] = datetime.utcnow().isoformat()
-            
-#         print("📌 Received Enhanced Answer Submission:", answer_dict)
-        
-#         # Save enhanced answer to Supabase with serialized timestamp
-#         response = supabase.table("user_progress").insert(answer_dict).execute()
-        
-#         if response.data and isinstance(response.data, dict) and "error" in response.data:
-#             raise HTTPException(status_code=500, detail=response.data["error"])
-            
-#         return {"message": "Answer recorded successfully!", "data": response.data}
-        
-#     except Exception as e:
-#         print("❌ Error submitting enhanced answer:", str(e))
-#         raise HTTPException(status_code=400, detail=str(e))
+def _empty_user_stats():
+    """Stats payload for a user with no recorded answers."""
+    return {
+        "total_questions": 0,
+        "correct_answers": 0,
+        "accuracy": 0,
+        "average_time": 0,
+        "by_topic": {}
+    }
 
 @router.get("/user-stats/{user_id}")
 async def get_user_stats(user_id: str):
     try:
-        # Fetch user's performance data
-        response = supabase.table("user_progress").select("*").eq("user_id", user_id).execute()
+        # user_stats takes a uuid, so a malformed id would make Postgres raise.
+        # It can't match any progress rows, so answer with empty stats instead.
+        try:
+            UUID(user_id)
+        except ValueError:
+            return _empty_user_stats()
+        
+        # Per-topic counters are aggregated in the user_stats SQL function
+        response = await run_in_threadpool(
+            supabase.rpc("user_stats", {"uid": user_id}).execute
+        )
         
         if not response.data:
-            return {
-                "total_questions": 0,
-                "correct_answers": 0,
-                "accuracy": 0,
-                "average_time": 0,
-                "by_topic": {}
-            }
+            return _empty_user_stats()
             
-        # Calculate statistics
-        answers = response.data
-        total_questions = len(answers)
-        correct_answers = sum(1 for answer in answers if answer.get("correct", False))
-        accuracy = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
-        
-        # Calculate average time taken - with safety checks for None values
-        valid_times = [answer.get("time_taken", 0) for answer in answers if answer.get("time_taken") is not None]
-        total_time = sum(valid_times)
-        average_time = total_time / len(valid_times) if valid_times else 0
-        
-        # Group by topic
+        # Combine the per-topic rows into overall and per-topic statistics
+        total_questions = 0
+        correct_answers = 0
+        total_time = 0
+        timed_answers = 0
         topics = {}
-        for answer in answers:
-            topic = answer.get("topic", "Unknown")
-            if topic not in topics:
-                topics[topic] = {
-                    "total": 0,
-                    "correct": 0,
-                    "total_time": 0,
-                    "times": []
-                }
+        for row in response.data:
+            total_questions += row["total"]
+            correct_answers += row["correct"]
+            total_time += row["sum_time"]
+            timed_answers += row["count_time"]
             
-            topics[topic]["total"] += 1
-            if answer.get("correct", False):
-                topics[topic]["correct"] += 1
-            
-            # Only add time if it's not None
-            time_taken = answer.get("time_taken")
-            if time_taken is not None:
-                topics[topic]["total_time"] += time_taken
-                topics[topic]["times"].append(time_taken)
+            topics[row["topic"]] = {
+                "total": row["total"],
+                "correct": row["correct"],
+                "accuracy": (row["correct"] / row["total"]) * 100 if row["total"] > 0 else 0,
+                "average_time": row["sum_time"] / row["count_time"] if row["count_time"] > 0 else 0
+            }
         
-        # Calculate per-topic statistics
-        for topic in topics:
-            total_valid_times = len(topics[topic]["times"])
-            if topics[topic]["total"] > 0:
-                topics[topic]["accuracy"] = (topics[topic]["correct"] / topics[topic]["total"]) * 100
-                topics[topic]["average_time"] = topics[topic]["total_time"] / total_valid_times if total_valid_times > 0 else 0
-            else:
-                topics[topic]["accuracy"] = 0
-                topics[topic]["average_time"] = 0
-            
-            # Remove temporary calculation fields
-            del topics[topic]["total_time"]
-            del topics[topic]["times"]
+        accuracy = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
+        average_time = total_time / timed_answers if timed_answers > 0 else 0
         
         return {
             "total_questions": total_questions,
@@ -143,7 +102,7 @@ async def get_user_stats(user_id: str):
         }
         
     except Exception as e:
-        print(f"❌ Error fetching user statistics: {str(e)}")
+        logger.exception("Error fetching user statistics")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get performance trends over time
@@ -151,11 +110,13 @@ async def get_user_stats(user_id: str):
 async def get_performance_trends(user_id: str):
     try:
         # Fetch user's performance data ordered by timestamp
-        response = supabase.table("user_progress")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .order("timestamp", desc=False)\
-            .execute()
+        response = await run_in_threadpool(
+            supabase.table("user_progress")
+            .select("timestamp,topic,correct,time_taken,difficulty_level,confidence")
+            .eq("user_id", user_id)
+            .order("timestamp", desc=False)
+            .execute
+        )
         
         if not response.data:
             return {"trends": []}
@@ -175,5 +136,5 @@ async def get_performance_trends(user_id: str):
         return {"trends": trends}
         
     except Exception as e:
-        print("❌ Error fetching performance trends:", str(e))
+        logger.exception("Error fetching performance trends")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file